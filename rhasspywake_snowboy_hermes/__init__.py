@@ -1,10 +1,14 @@
 """Hermes MQTT server for Rhasspy wakeword with snowboy"""
 import asyncio
+import io
 import logging
 import queue
 import socket
+import struct
 import threading
 import typing
+import warnings
+import wave
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -22,7 +26,20 @@ from rhasspyhermes.wake import (
     HotwordToggleReason,
 )
 
+try:
+    # Deprecated in Python 3.11 and removed in 3.13.
+    # Audio conversion falls back to sox without it.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop  # pylint: disable=deprecated-module
+except ImportError:
+    audioop = None  # type: ignore
+
 WAV_HEADER_BYTES = 44
+
+# RIFF, size, WAVE, fmt, fmt size, format, channels, rate, byte rate,
+# block align, bits per sample, data, data size
+_WAV_HEADER_FORMAT = "<4sI4s4sIHHIIHH4sI"
 _LOGGER = logging.getLogger(__name__)
 
 # -----------------------------------------------------------------------------
@@ -63,6 +80,7 @@ class WakeHermesMqtt(HermesClient):
         chunk_size: int = 960,
         udp_audio: typing.Optional[typing.List[typing.Tuple[str, int, str]]] = None,
         udp_chunk_size: int = 2048,
+        silence_threshold: typing.Optional[int] = None,
     ):
         super().__init__(
             "rhasspywake_snowboy_hermes",
@@ -89,15 +107,40 @@ class WakeHermesMqtt(HermesClient):
 
         self.chunk_size = chunk_size
 
+        # Chunks with RMS energy below this are not given to detectors
+        if (silence_threshold is not None) and (audioop is None):
+            raise ValueError(
+                "silence_threshold requires the audioop module (removed in Python 3.13)"
+            )
+
+        self.silence_threshold = silence_threshold
+
+        # Resampling state for audioop.ratecv.
+        # Key is (site_id, in_rate, out_rate, channels, sample_width).
+        self.ratecv_states: typing.Dict[
+            typing.Tuple[typing.Optional[str], int, int, int, int], typing.Any
+        ] = {}
+
         # Queue of WAV audio chunks to process (plus site_id)
         self.wav_queue: queue.Queue = queue.Queue()
 
         self.first_audio: bool = True
-        self.audio_buffer = bytes()
 
-        # Load detector
+        # Persistent audio buffer with read offset.
+        # Consumed audio is only removed once enough has piled up.
+        self.audio_buffer = bytearray()
+        self.audio_read_pos = 0
+        self.audio_compact_chunks = 64
+
+        # Load detector.
+        # Expected to be done up front with load_detectors() so the model
+        # files aren't read while audio is waiting.
         self.detectors: typing.List[typing.Any] = []
+        self.indexed_detectors: typing.List[typing.Tuple[int, typing.Any]] = []
         self.model_ids: typing.List[str] = []
+        self.detector_wakeword_ids: typing.List[str] = []
+        self.detectors_lock = threading.RLock()
+        self.detectors_loaded = threading.Event()
 
         # Start threads
         threading.Thread(target=self.detection_thread_proc, daemon=True).start()
@@ -119,23 +162,39 @@ class WakeHermesMqtt(HermesClient):
         """Load snowboy detectors from models"""
         from snowboy import snowboydecoder, snowboydetect
 
-        self.model_ids = []
-        self.detectors = []
+        model_ids: typing.List[str] = []
+        detector_wakeword_ids: typing.List[str] = []
+        detectors: typing.List[typing.Any] = []
 
-        for model in self.models:
-            assert model.model_path.is_file(), f"Missing {model.model_path}"
-            _LOGGER.debug("Loading snowboy model: %s", model)
+        with self.detectors_lock:
+            for model_index, model in enumerate(self.models):
+                assert model.model_path.is_file(), f"Missing {model.model_path}"
+                _LOGGER.debug("Loading snowboy model: %s", model)
 
-            detector = snowboydetect.SnowboyDetect(
-                snowboydecoder.RESOURCE_FILE.encode(), str(model.model_path).encode()
-            )
+                detector = snowboydetect.SnowboyDetect(
+                    snowboydecoder.RESOURCE_FILE.encode(),
+                    str(model.model_path).encode(),
+                )
+
+                detector.SetSensitivity(model.sensitivity.encode())
+                detector.SetAudioGain(model.audio_gain)
+                detector.ApplyFrontend(model.apply_frontend)
 
-            detector.SetSensitivity(model.sensitivity.encode())
-            detector.SetAudioGain(model.audio_gain)
-            detector.ApplyFrontend(model.apply_frontend)
+                detectors.append(detector)
+                model_ids.append(model.model_path.stem)
 
-            self.detectors.append(detector)
-            self.model_ids.append(model.model_path.stem)
+                # Use file name when no wakeword id is given
+                wakeword_id = ""
+                if model_index < len(self.wakeword_ids):
+                    wakeword_id = self.wakeword_ids[model_index]
+
+                detector_wakeword_ids.append(wakeword_id or model.model_path.stem)
+
+            self.model_ids = model_ids
+            self.detector_wakeword_ids = detector_wakeword_ids
+            self.detectors = detectors
+            self.indexed_detectors = list(enumerate(detectors))
+            self.detectors_loaded.set()
 
     # -------------------------------------------------------------------------
 
@@ -150,8 +209,6 @@ class WakeHermesMqtt(HermesClient):
     ]:
         """Handle a successful hotword detection"""
         try:
-            assert len(self.model_ids) > model_index, f"Missing {model_index} in models"
-
             yield (
                 HotwordDetected(
                     site_id=site_id,
@@ -214,25 +271,67 @@ class WakeHermesMqtt(HermesClient):
     def detection_thread_proc(self):
         """Handle WAV audio chunks."""
         try:
+            # Frame from a different site that ended the previous batch
+            next_frame: typing.Optional[typing.Tuple[bytes, str]] = None
+
             while True:
-                wav_bytes, site_id = self.wav_queue.get()
+                if next_frame is None:
+                    wav_bytes, site_id = self.wav_queue.get()
+                else:
+                    wav_bytes, site_id = next_frame
+                    next_frame = None
+
+                if not self.detectors_loaded.is_set():
+                    # Fall back to loading on first audio
+                    with self.detectors_lock:
+                        if not self.detectors_loaded.is_set():
+                            self.load_detectors()
+
+                # Extract/convert audio data and add to persistent buffer
+                self.audio_buffer.extend(
+                    self.wav_audio_view(wav_bytes, site_id=site_id)
+                )
 
-                if not self.detectors:
-                    self.load_detectors()
+                # Batch any frames already waiting for the same site
+                while True:
+                    try:
+                        wav_bytes, frame_site_id = self.wav_queue.get_nowait()
+                    except queue.Empty:
+                        break
 
-                # Extract/convert audio data
-                audio_data = self.maybe_convert_wav(wav_bytes)
+                    if frame_site_id != site_id:
+                        next_frame = (wav_bytes, frame_site_id)
+                        break
 
-                # Add to persistent buffer
-                self.audio_buffer += audio_data
+                    self.audio_buffer.extend(
+                        self.wav_audio_view(wav_bytes, site_id=site_id)
+                    )
 
                 # Process in chunks.
                 # Any remaining audio data will be kept in buffer.
-                while len(self.audio_buffer) >= self.chunk_size:
-                    chunk = self.audio_buffer[: self.chunk_size]
-                    self.audio_buffer = self.audio_buffer[self.chunk_size :]
+                # Each chunk is copied once and shared by all detectors.
+                chunk_size = self.chunk_size
+                sample_width = self.sample_width
+                silence_threshold = self.silence_threshold
+                indexed_detectors = self.indexed_detectors
+                detector_wakeword_ids = self.detector_wakeword_ids
+                read_pos = self.audio_read_pos
+
+                audio_view = memoryview(self.audio_buffer)
+                num_chunks = (len(self.audio_buffer) - read_pos) // chunk_size
+
+                for chunk_start in range(
+                    read_pos, read_pos + (num_chunks * chunk_size), chunk_size
+                ):
+                    chunk = bytes(audio_view[chunk_start : chunk_start + chunk_size])
+
+                    if (silence_threshold is not None) and (
+                        audioop.rms(chunk, sample_width) < silence_threshold
+                    ):
+                        # Skip detection on silence
+                        continue
 
-                    for detector_index, detector in enumerate(self.detectors):
+                    for detector_index, detector in indexed_detectors:
                         # Return is:
                         # -2 silence
                         # -1 error
@@ -242,20 +341,7 @@ class WakeHermesMqtt(HermesClient):
 
                         if result_index > 0:
                             # Detection
-                            if detector_index < len(self.wakeword_ids):
-                                wakeword_id = self.wakeword_ids[detector_index]
-                            else:
-                                wakeword_id = ""
-
-                            if not wakeword_id:
-                                if detector_index < len(self.models):
-                                    # Use file name
-                                    wakeword_id = self.models[
-                                        detector_index
-                                    ].model_path.stem
-                                else:
-                                    # Fall back to default
-                                    wakeword_id = "default"
+                            wakeword_id = detector_wakeword_ids[detector_index]
 
                             _LOGGER.debug(
                                 "Wake word detected: %s (site_id=%s)",
@@ -271,11 +357,206 @@ class WakeHermesMqtt(HermesClient):
                                 ),
                                 self.loop,
                             )
+
+                self.audio_read_pos = read_pos + (num_chunks * chunk_size)
+
+                # View must be released before buffer can be resized
+                audio_view.release()
+
+                if self.audio_read_pos == len(self.audio_buffer):
+                    # Frames were a multiple of the chunk size, so nothing is left
+                    self.audio_buffer.clear()
+                    self.audio_read_pos = 0
+                elif self.audio_read_pos >= (self.audio_compact_chunks * chunk_size):
+                    # Drop consumed audio
+                    del self.audio_buffer[: self.audio_read_pos]
+                    self.audio_read_pos = 0
         except Exception:
             _LOGGER.exception("detection_thread_proc")
 
     # -------------------------------------------------------------------------
 
+    def maybe_convert_wav(
+        self,
+        wav_bytes: bytes,
+        sample_rate: typing.Optional[int] = None,
+        sample_width: typing.Optional[int] = None,
+        channels: typing.Optional[int] = None,
+    ) -> bytes:
+        """Converts WAV data to required format if necessary. Returns raw audio."""
+        return bytes(
+            self.wav_audio_view(
+                wav_bytes,
+                sample_rate=sample_rate,
+                sample_width=sample_width,
+                channels=channels,
+            )
+        )
+
+    def wav_audio_view(
+        self,
+        wav_bytes: bytes,
+        sample_rate: typing.Optional[int] = None,
+        sample_width: typing.Optional[int] = None,
+        channels: typing.Optional[int] = None,
+        site_id: typing.Optional[str] = None,
+    ) -> typing.Union[bytes, memoryview]:
+        """Like maybe_convert_wav, but avoids copying audio that needs no conversion."""
+        if sample_rate is None:
+            sample_rate = self.sample_rate
+
+        if sample_width is None:
+            sample_width = self.sample_width
+
+        if channels is None:
+            channels = self.channels
+
+        if len(wav_bytes) >= WAV_HEADER_BYTES:
+            # Skip WAV parsing for canonical 44-byte headers in the right format
+            (
+                riff_id,
+                _riff_size,
+                wave_id,
+                fmt_id,
+                fmt_size,
+                fmt_tag,
+                wav_channels,
+                wav_rate,
+                _byte_rate,
+                _block_align,
+                wav_bits,
+                data_id,
+                data_size,
+            ) = struct.unpack_from(_WAV_HEADER_FORMAT, wav_bytes)
+
+            if (
+                (riff_id == b"RIFF")
+                and (wave_id == b"WAVE")
+                and (fmt_id == b"fmt ")
+                and (fmt_size == 16)
+                and (fmt_tag == 1)
+                and (data_id == b"data")
+                and (data_size == (len(wav_bytes) - WAV_HEADER_BYTES))
+                and (wav_rate == sample_rate)
+                and (wav_bits == (sample_width * 8))
+                and (wav_channels == channels)
+            ):
+                return memoryview(wav_bytes)[WAV_HEADER_BYTES:]
+
+        with io.BytesIO(wav_bytes) as wav_io:
+            with wave.open(wav_io, "rb") as wav_file:
+                if (
+                    (wav_file.getframerate() != sample_rate)
+                    or (wav_file.getsampwidth() != sample_width)
+                    or (wav_file.getnchannels() != channels)
+                ):
+                    # Return converted wav
+                    return self.convert_wav(
+                        wav_bytes,
+                        sample_rate=sample_rate,
+                        sample_width=sample_width,
+                        channels=channels,
+                        site_id=site_id,
+                    )
+
+                # wave stops reading right at the start of the data chunk
+                data_start = wav_io.tell()
+                data_end = data_start + (
+                    wav_file.getnframes() * sample_width * channels
+                )
+
+        # Return original audio without copying it out of the WAV
+        return memoryview(wav_bytes)[data_start:data_end]
+
+    def convert_wav(
+        self,
+        wav_bytes: bytes,
+        sample_rate: typing.Optional[int] = None,
+        sample_width: typing.Optional[int] = None,
+        channels: typing.Optional[int] = None,
+        site_id: typing.Optional[str] = None,
+    ) -> bytes:
+        """Converts WAV data to required format with audioop. Return raw audio.
+
+        Resampling state is kept per site_id so consecutive frames join up.
+        Note that audioop.ratecv interpolates linearly with no anti-aliasing
+        filter, so downsampling (e.g. 44.1/48 kHz to 16 kHz) is lower quality
+        than with sox.
+        """
+        if sample_rate is None:
+            sample_rate = self.sample_rate
+
+        if sample_width is None:
+            sample_width = self.sample_width
+
+        if channels is None:
+            channels = self.channels
+
+        if audioop is None:
+            # Python 3.13+
+            return super().convert_wav(
+                wav_bytes,
+                sample_rate=sample_rate,
+                sample_width=sample_width,
+                channels=channels,
+            )
+
+        try:
+            with io.BytesIO(wav_bytes) as wav_io:
+                with wave.open(wav_io, "rb") as wav_file:
+                    in_rate = wav_file.getframerate()
+                    in_width = wav_file.getsampwidth()
+                    in_channels = wav_file.getnchannels()
+                    audio_data = wav_file.readframes(wav_file.getnframes())
+        except wave.Error:
+            # Not PCM audio
+            return super().convert_wav(
+                wav_bytes,
+                sample_rate=sample_rate,
+                sample_width=sample_width,
+                channels=channels,
+            )
+
+        if (in_channels not in (1, 2)) or (channels not in (1, 2)):
+            # Only mono/stereo mixing is supported here
+            return super().convert_wav(
+                wav_bytes,
+                sample_rate=sample_rate,
+                sample_width=sample_width,
+                channels=channels,
+            )
+
+        if in_width == 1:
+            # 8-bit WAV audio is unsigned
+            audio_data = audioop.bias(audio_data, 1, -128)
+
+        if (in_channels == 2) and (channels == 1):
+            # Mix down before any other work
+            audio_data = audioop.tomono(audio_data, in_width, 0.5, 0.5)
+            in_channels = 1
+
+        if in_width != sample_width:
+            audio_data = audioop.lin2lin(audio_data, in_width, sample_width)
+
+        if in_rate != sample_rate:
+            # Keep filter state between frames of the same stream
+            state_key = (site_id, in_rate, sample_rate, in_channels, sample_width)
+            audio_data, self.ratecv_states[state_key] = audioop.ratecv(
+                audio_data,
+                sample_width,
+                in_channels,
+                in_rate,
+                sample_rate,
+                self.ratecv_states.get(state_key),
+            )
+
+        if in_channels != channels:
+            audio_data = audioop.tostereo(audio_data, sample_width, 1, 1)
+
+        return audio_data
+
+    # -------------------------------------------------------------------------
+
     def udp_thread_proc(self, host: str, port: int, site_id: str):
         """Handle WAV chunks from UDP socket."""
         try:
@@ -303,8 +584,12 @@ class WakeHermesMqtt(HermesClient):
         topic: typing.Optional[str] = None,
     ) -> GeneratorType:
         """Received message from MQTT broker."""
-        # Check enable/disable messages
-        if isinstance(message, HotwordToggleOn):
+        # Audio frames are by far the most common message
+        if isinstance(message, AudioFrame):
+            if self.enabled:
+                assert site_id, "Missing site_id"
+                await self.handle_audio_frame(message.wav_bytes, site_id=site_id)
+        elif isinstance(message, HotwordToggleOn):
             if message.reason == HotwordToggleReason.UNKNOWN:
                 # Always enable on unknown
                 self.disabled_reasons.clear()
@@ -321,10 +606,6 @@ class WakeHermesMqtt(HermesClient):
             self.enabled = False
             self.disabled_reasons.add(message.reason)
             _LOGGER.debug("Disabled")
-        elif isinstance(message, AudioFrame):
-            if self.enabled:
-                assert site_id, "Missing site_id"
-                await self.handle_audio_frame(message.wav_bytes, site_id=site_id)
         elif isinstance(message, GetHotwords):
             async for hotword_result in self.handle_get_hotwords(message):
                 yield hotword_result
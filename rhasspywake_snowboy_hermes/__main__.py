@@ -51,6 +51,11 @@ def main():
         action="append",
         help="Host/port/siteId for UDP audio input",
     )
+    parser.add_argument(
+        "--silence-threshold",
+        type=int,
+        help="Skip detection for audio chunks with RMS energy below this value (default: disabled)",
+    )
 
     hermes_cli.add_hermes_args(parser)
     args = parser.parse_args()
@@ -102,7 +107,9 @@ def main():
     if args.stdin_audio:
         # Read WAV from stdin, detect, and exit
         client = None
-        hermes = WakeHermesMqtt(client, models, wakeword_ids)
+        hermes = WakeHermesMqtt(
+            client, models, wakeword_ids, silence_threshold=args.silence_threshold
+        )
 
         hermes.load_detectors()
 
@@ -133,6 +140,7 @@ def main():
         model_dirs=args.model_dir,
         udp_audio=udp_audio,
         site_ids=args.site_id,
+        silence_threshold=args.silence_threshold,
     )
 
     hermes.load_detectors()
@@ -0,0 +1,124 @@
+"""Tests for WAV audio extraction and conversion"""
+import io
+import struct
+import unittest
+import wave
+
+from rhasspywake_snowboy_hermes import WakeHermesMqtt, audioop
+
+# -----------------------------------------------------------------------------
+
+
+class FakeMqttClient:
+    """Stand-in for paho MQTT client (only needs settable callbacks)."""
+
+
+def to_wav_bytes(
+    audio_data: bytes,
+    sample_rate: int = 16000,
+    sample_width: int = 2,
+    channels: int = 1,
+) -> bytes:
+    """Wrap raw audio in a canonical WAV header."""
+    with io.BytesIO() as wav_buffer:
+        wav_file: wave.Wave_write = wave.open(wav_buffer, "wb")
+        with wav_file:
+            wav_file.setframerate(sample_rate)
+            wav_file.setsampwidth(sample_width)
+            wav_file.setnchannels(channels)
+            wav_file.writeframes(audio_data)
+
+        return wav_buffer.getvalue()
+
+
+def add_chunk(wav_bytes: bytes, chunk_id: bytes, chunk_data: bytes, before_data: bool):
+    """Insert an extra RIFF chunk before or after the data chunk."""
+    chunk = chunk_id + struct.pack("<I", len(chunk_data)) + chunk_data
+    if before_data:
+        # Canonical header has "data" at byte 36
+        wav_bytes = wav_bytes[:36] + chunk + wav_bytes[36:]
+    else:
+        wav_bytes = wav_bytes + chunk
+
+    # Fix RIFF size
+    return wav_bytes[:4] + struct.pack("<I", len(wav_bytes) - 8) + wav_bytes[8:]
+
+
+# -----------------------------------------------------------------------------
+
+
+class WavAudioTestCase(unittest.TestCase):
+    """Tests for WakeHermesMqtt.wav_audio_view and convert_wav"""
+
+    def setUp(self):
+        self.hermes = WakeHermesMqtt(FakeMqttClient(), [], [])
+        self.audio_data = bytes(range(256)) * 4
+
+    def test_canonical_header(self):
+        """Canonical 44-byte header in the required format is sliced directly."""
+        wav_bytes = to_wav_bytes(self.audio_data)
+        audio_view = self.hermes.wav_audio_view(wav_bytes)
+
+        self.assertIsInstance(audio_view, memoryview)
+        self.assertEqual(bytes(audio_view), self.audio_data)
+        self.assertEqual(self.hermes.maybe_convert_wav(wav_bytes), self.audio_data)
+
+    def test_chunk_before_data(self):
+        """LIST chunk before data is skipped."""
+        wav_bytes = add_chunk(
+            to_wav_bytes(self.audio_data), b"LIST", b"INFOtest", before_data=True
+        )
+        audio_view = self.hermes.wav_audio_view(wav_bytes)
+
+        self.assertIsInstance(audio_view, memoryview)
+        self.assertEqual(bytes(audio_view), self.audio_data)
+
+    def test_chunk_after_data(self):
+        """Chunks after data are not included in audio."""
+        wav_bytes = add_chunk(
+            to_wav_bytes(self.audio_data), b"LIST", b"INFOtest", before_data=False
+        )
+        audio_view = self.hermes.wav_audio_view(wav_bytes)
+
+        self.assertIsInstance(audio_view, memoryview)
+        self.assertEqual(bytes(audio_view), self.audio_data)
+
+    @unittest.skipIf(audioop is None, "audioop not available")
+    def test_stereo_to_mono(self):
+        """Stereo audio is mixed down to mono."""
+        left = struct.pack("<4h", 100, 200, -300, 400)
+        right = struct.pack("<4h", 300, 0, -100, 0)
+        stereo = b"".join(
+            left[i : i + 2] + right[i : i + 2] for i in range(0, len(left), 2)
+        )
+
+        audio_data = self.hermes.maybe_convert_wav(to_wav_bytes(stereo, channels=2))
+        self.assertEqual(struct.unpack("<4h", audio_data), (200, 100, -200, 200))
+
+    @unittest.skipIf(audioop is None, "audioop not available")
+    def test_8bit_to_16bit(self):
+        """Unsigned 8-bit audio is converted to signed 16-bit."""
+        audio_data = self.hermes.maybe_convert_wav(
+            to_wav_bytes(bytes([128, 255, 0]), sample_width=1)
+        )
+        self.assertEqual(struct.unpack("<3h", audio_data), (0, 127 * 256, -128 * 256))
+
+    @unittest.skipIf(audioop is None, "audioop not available")
+    def test_resample(self):
+        """44.1 kHz audio is resampled to 16 kHz."""
+        num_frames = 44100 // 10
+        wav_bytes = to_wav_bytes(bytes(num_frames * 2), sample_rate=44100)
+        audio_data = self.hermes.maybe_convert_wav(wav_bytes)
+
+        # 100 ms of audio (allow for filter delay)
+        self.assertAlmostEqual(len(audio_data) // 2, 1600, delta=2)
+
+    @unittest.skipIf(audioop is None, "audioop not available")
+    def test_resample_state_per_site(self):
+        """Each site keeps its own resampling state."""
+        wav_bytes = to_wav_bytes(bytes(882), sample_rate=44100)
+        self.hermes.wav_audio_view(wav_bytes, site_id="site1")
+        self.hermes.wav_audio_view(wav_bytes, site_id="site2")
+
+        site_ids = {state_key[0] for state_key in self.hermes.ratecv_states}
+        self.assertEqual(site_ids, {"site1", "site2"})